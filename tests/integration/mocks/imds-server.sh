@@ -7,6 +7,8 @@ PORT="${2:-80}"
 TOKEN="mock-imds-token-12345"
 
 serve_request() {
+    BODY=""
+    BODY_FILE=""
     while read -r line; do
         # Trim carriage return
         line=$(echo "${line}" | tr -d '\r')
@@ -15,11 +17,11 @@ serve_request() {
         case "${line}" in
             GET\ /*)
                 METHOD="GET"
-                PATH=$(echo "${line}" | cut -d' ' -f2)
+                REQUEST_PATH=$(echo "${line}" | cut -d' ' -f2)
                 ;;
             PUT\ /*)
                 METHOD="PUT"
-                PATH=$(echo "${line}" | cut -d' ' -f2)
+                REQUEST_PATH=$(echo "${line}" | cut -d' ' -f2)
                 ;;
             "")
                 # End of headers
@@ -29,13 +31,14 @@ serve_request() {
     done
 
     # Handle token request (IMDSv2)
-    if [ "${METHOD}" = "PUT" ] && [ "${PATH}" = "/latest/api/token" ]; then
+    if [ "${METHOD}" = "PUT" ] && [ "${REQUEST_PATH}" = "/latest/api/token" ]; then
         BODY="${TOKEN}"
+        CONTENT_LENGTH=${#BODY}
         CONTENT_TYPE="text/plain"
     # Handle metadata requests
     elif [ "${METHOD}" = "GET" ]; then
         # Map URL path to file
-        FILE_PATH="${IMDS_ROOT}${PATH}"
+        FILE_PATH="${IMDS_ROOT}${REQUEST_PATH}"
 
         # Check for index.html if path is a directory
         if [ -d "${FILE_PATH}" ]; then
@@ -43,7 +46,9 @@ serve_request() {
         fi
 
         if [ -f "${FILE_PATH}" ]; then
-            BODY=$(cat "${FILE_PATH}")
+            # Stream the file as-is rather than capturing it in a variable
+            BODY_FILE="${FILE_PATH}"
+            CONTENT_LENGTH=$(wc -c < "${FILE_PATH}")
             CONTENT_TYPE="text/plain"
         else
             # 404 Not Found
@@ -57,12 +62,15 @@ serve_request() {
     fi
 
     # Send response
-    CONTENT_LENGTH=$(echo -n "${BODY}" | wc -c)
     printf "HTTP/1.1 200 OK\r\n"
     printf "Content-Type: %s\r\n" "${CONTENT_TYPE}"
     printf "Content-Length: %d\r\n" "${CONTENT_LENGTH}"
     printf "\r\n"
-    printf "%s" "${BODY}"
+    if [ -n "${BODY_FILE}" ]; then
+        cat "${BODY_FILE}"
+    else
+        printf "%s" "${BODY}"
+    fi
 }
 
 # Listen and serve
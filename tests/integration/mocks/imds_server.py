@@ -11,11 +11,16 @@ Emulates IMDSv2 behavior:
 - Returns proper error codes: 400, 401, 403, 404
 """
 
+import collections
+import http
 import http.server
 import json
+import os
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 from datetime import datetime, timezone
 from pathlib import Path
@@ -23,6 +28,9 @@ from pathlib import Path
 TOKEN = "mock-imds-token-12345"
 TOKEN_TTL = 21600
 
+# Use HTTP/1.1 like real IMDS
+PROTOCOL_VERSION = "HTTP/1.1"
+
 # Defaults; overridden by sys.argv in __main__ block.
 PORT = 8080
 SCENARIOS_DIR = Path("scenarios")
@@ -30,21 +38,94 @@ SCENARIO = "basic-boot"
 NIC_COUNT = 1
 SPOT_TERMINATION_DELAY = 0
 
+# Per-request access log lines; set IMDS_QUIET to drop them, e.g. when
+# timing boots. Rejections and errors are always logged.
+ACCESS_LOG = not os.environ.get("IMDS_QUIET")
+
 # Track server start time for spot termination simulation
 SERVER_START_TIME = time.time()
 
-# User data bytes, populated at startup if user-data-setup.sh is present.
-USER_DATA_BYTES: bytes | None = None
+# User data file descriptor and size, populated by configure().
+USER_DATA_FD: int | None = None
+USER_DATA_SIZE = 0
+
+
+# Log lines waiting for the writer thread; the oldest are dropped if it
+# falls behind, or if it was never started as in the unit tests.
+LOG_BUFFER = collections.deque(maxlen=4096)
+LOG_INTERVAL = 0.05
+
+
+def log(msg):
+    """Queue a message for the log writer, so request threads never
+    block on a write to stderr."""
+    LOG_BUFFER.append(f"IMDS: {msg}\n".encode())
+
+
+def flush_log():
+    """Write all queued log lines to stderr in a single write."""
+    lines = []
+    while True:
+        try:
+            lines.append(LOG_BUFFER.popleft())
+        except IndexError:
+            break
+    if lines:
+        sys.stderr.buffer.write(b"".join(lines))
+        sys.stderr.buffer.flush()
+
+
+def _log_writer():
+    while True:
+        time.sleep(LOG_INTERVAL)
+        flush_log()
+
+
+def _open_file(path):
+    if not path.is_file():
+        return None, 0
+    fd = os.open(path, os.O_RDONLY)
+    return fd, os.fstat(fd).st_size
+
+
+def open_user_data():
+    """Open the scenario's user data once so it can be sent with sendfile().
+    A user-data-setup.sh script takes precedence over user-data.yaml.
+    Returns (fd, size), or (None, 0) if the scenario has no user data."""
+    scenario_dir = SCENARIOS_DIR / SCENARIO
+    setup_script = scenario_dir / "user-data-setup.sh"
+    if setup_script.is_file():
+        # The descriptor stays readable after the directory is removed.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            subprocess.run(["sh", str(setup_script), tmpdir], check=True)
+            return _open_file(Path(tmpdir) / "user-data.yaml")
+    return _open_file(scenario_dir / "user-data.yaml")
 
-# Generate MACs for each NIC (QEMU style: 52:54:00:12:34:XX)
-def generate_macs(count):
-    """Generate sequential MAC addresses starting from QEMU default."""
+
+def cached(body):
+    """Pair a response body with its Content-Length so neither is
+    recomputed per request."""
+    return body, b"%d" % len(body)
+
+
+def build_nics(count):
+    """Generate sequential MAC addresses starting from the QEMU default
+    (52:54:00:12:34:XX), along with the cached MAC listing and the
+    per-interface attribute responses keyed by MAC, in one pass."""
     macs = []
+    nic_responses = {}
     for i in range(count):
-        macs.append(f"52:54:00:12:34:{86 + i:02x}")
-    return macs
+        mac = f"52:54:00:12:34:{86 + i:02x}"
+        macs.append(mac)
+        nic_responses[mac] = {
+            "device-number": cached(str(i).encode()),
+            "local-ipv4s": cached(f"10.0.2.{15 + i}".encode()),
+            "subnet-id": cached(f"subnet-test{i}".encode()),
+            "vpc-id": cached(b"vpc-test123"),
+        }
+    macs_list = cached(b"\n".join(f"{mac}/".encode() for mac in macs))
+    return macs, macs_list, nic_responses
 
-MACS = generate_macs(NIC_COUNT)
 
 # Static metadata responses
 METADATA = {
@@ -70,10 +151,126 @@ IAM_CREDENTIALS = {
     "Expiration": "2099-12-31T23:59:59Z",
 }
 
+# Dynamic instance identity document
+INSTANCE_IDENTITY = {
+    "accountId": "123456789012",
+    "architecture": "x86_64",
+    "availabilityZone": "us-east-1a",
+    "billingProducts": None,
+    "devpayProductCodes": None,
+    "marketplaceProductCodes": None,
+    "imageId": "ami-test12345",
+    "instanceId": "i-test12345",
+    "instanceType": "t3.micro",
+    "kernelId": None,
+    "pendingTime": "2024-01-01T00:00:00Z",
+    "privateIp": "10.0.2.15",
+    "ramdiskId": None,
+    "region": "us-east-1",
+    "version": "2017-09-30",
+}
+
+# Static response bodies, encoded once at import.
+TOKEN_BYTES = cached(TOKEN.encode())
+METADATA_BYTES = {k: cached(v.encode()) for k, v in METADATA.items()}
+IAM_ROLE_BYTES = cached(IAM_ROLE.encode())
+IAM_CREDS_BYTES = cached(json.dumps(IAM_CREDENTIALS).encode())
+INSTANCE_IDENTITY_BYTES = cached(json.dumps(INSTANCE_IDENTITY).encode())
+
+
+def render_headers(code, content_type, content_length, connection,
+                   extra_headers=b""):
+    """Render the status line and headers of a response. extra_headers
+    holds any further CRLF-terminated header lines."""
+    return (
+        b"%b %d %b\r\nContent-Type: %b\r\nContent-Length: %b\r\n"
+        b"Connection: %b\r\n%b\r\n" % (
+            PROTOCOL_VERSION.encode(), code,
+            http.HTTPStatus(code).phrase.encode(), content_type,
+            content_length, connection, extra_headers,
+        ))
+
+
+def raw_response(entry, content_type, extra_headers=b""):
+    """Render a complete keep-alive 200 response, from status line to body,
+    so serving it is a single write. Returns the response and the body
+    size for the access log."""
+    content_bytes, content_length = entry
+    return (
+        render_headers(200, content_type, content_length, b"keep-alive",
+                       extra_headers) + content_bytes,
+        len(content_bytes),
+    )
+
+
+# Token response for the default TTL, which is what clients normally ask for.
+TOKEN_RESPONSE = raw_response(
+    TOKEN_BYTES, b"text/plain",
+    b"X-aws-ec2-metadata-token-ttl-seconds: %d\r\n" % TOKEN_TTL)
+
+
+def build_routes():
+    """Map every static GET path to its cached response and content type.
+    Once the scenario and NIC count are known every valid path is fixed,
+    including each per-interface attribute, so a request is a single
+    lookup on the raw path."""
+    routes = {
+        f"/latest/meta-data/{key}": (entry, b"text/plain")
+        for key, entry in METADATA_BYTES.items()
+    }
+    for path in ("iam/security-credentials/", "iam/security-credentials"):
+        routes[f"/latest/meta-data/{path}"] = (IAM_ROLE_BYTES, b"text/plain")
+    routes[f"/latest/meta-data/iam/security-credentials/{IAM_ROLE}"] = (
+        IAM_CREDS_BYTES, b"application/json")
+    for path in ("network/interfaces/macs/", "network/interfaces/macs"):
+        routes[f"/latest/meta-data/{path}"] = (MACS_LIST_BYTES, b"text/plain")
+    for mac, attrs in NIC_RESPONSES.items():
+        for attr, entry in attrs.items():
+            routes[f"/latest/meta-data/network/interfaces/macs/{mac}/{attr}"] = (
+                entry, b"text/plain")
+    routes["/latest/dynamic/instance-identity/document"] = (
+        INSTANCE_IDENTITY_BYTES, b"application/json")
+    return routes
+
+
+def build_raw_routes(routes):
+    """Render every route in the table as a complete response."""
+    return {
+        path: raw_response(entry, content_type)
+        for path, (entry, content_type) in routes.items()
+    }
+
+
+# Tables derived from the scenario and NIC count, populated by configure().
+MACS: list[str] = []
+MACS_LIST_BYTES = cached(b"")
+NIC_RESPONSES: dict[str, dict[str, tuple[bytes, bytes]]] = {}
+ROUTES: dict[str, tuple[tuple[bytes, bytes], bytes]] = {}
+RAW_ROUTES: dict[str, tuple[bytes, int]] = {}
+
+
+def configure(scenarios_dir, scenario, nic_count):
+    """Select the scenario and NIC count and rebuild every table derived
+    from them, so the route tables can never disagree with each other."""
+    global SCENARIOS_DIR, SCENARIO, NIC_COUNT
+    global MACS, MACS_LIST_BYTES, NIC_RESPONSES
+    global USER_DATA_FD, USER_DATA_SIZE, ROUTES, RAW_ROUTES
+    SCENARIOS_DIR = scenarios_dir
+    SCENARIO = scenario
+    NIC_COUNT = nic_count
+    MACS, MACS_LIST_BYTES, NIC_RESPONSES = build_nics(nic_count)
+    if USER_DATA_FD is not None:
+        os.close(USER_DATA_FD)
+    USER_DATA_FD, USER_DATA_SIZE = open_user_data()
+    ROUTES = build_routes()
+    RAW_ROUTES = build_raw_routes(ROUTES)
+
 
 class IMDSHandler(http.server.BaseHTTPRequestHandler):
-    # Use HTTP/1.1 like real IMDS
-    protocol_version = "HTTP/1.1"
+    protocol_version = PROTOCOL_VERSION
+    # Responses are written in one piece, so don't hold them back
+    # waiting for the client's ACK.
+    disable_nagle_algorithm = True
 
     def handle(self):
         try:
@@ -82,35 +279,68 @@ class IMDSHandler(http.server.BaseHTTPRequestHandler):
             pass
 
     def log_message(self, fmt, *args):
-        print(f"IMDS: {fmt % args}", file=sys.stderr, flush=True)
-
-    def _send_text(self, code, content_bytes, content_type="text/plain"):
-        """Send a response with proper headers."""
-        self.send_response(code)
-        self.send_header("Content-Type", content_type)
-        self.send_header("Content-Length", str(len(content_bytes)))
-        self.end_headers()
-        self.wfile.write(content_bytes)
+        log(fmt % args)
+
+    def log_request(self, code="-", size="-"):
+        if ACCESS_LOG:
+            super().log_request(code, size)
+
+    def _headers(self, code, content_type, content_length, extra_headers=b""):
+        """Render headers with the Connection value this request will get."""
+        connection = b"close" if self.close_connection else b"keep-alive"
+        return render_headers(
+            code, content_type, content_length, connection, extra_headers)
+
+    def _send(self, code, entry, content_type=b"text/plain", extra_headers=b""):
+        """Send the status line, headers and body of a response in a
+        single write. entry is a (body, length) pair from cached()."""
+        content_bytes, content_length = entry
+        self.log_request(code, len(content_bytes))
+        self.wfile.write(
+            self._headers(code, content_type, content_length, extra_headers)
+            + content_bytes)
+
+    def _send_raw(self, response):
+        """Send a response prerendered by raw_response()."""
+        raw, size = response
+        self.log_request(200, size)
+        self.wfile.write(raw)
+
+    def _send_user_data(self):
+        """Send user data straight from its file with sendfile(), so it
+        is never copied through Python."""
+        if USER_DATA_FD is None:
+            self._send_error_response(404, "Not Found")
+            return
+        self.log_request(200, USER_DATA_SIZE)
+        # Content-type is application/octet-stream per AWS docs
+        self.wfile.write(self._headers(
+            200, b"application/octet-stream", b"%d" % USER_DATA_SIZE))
+        sock_fd = self.connection.fileno()
+        offset = 0
+        while offset < USER_DATA_SIZE:
+            sent = os.sendfile(
+                sock_fd, USER_DATA_FD, offset, USER_DATA_SIZE - offset)
+            if sent == 0:
+                # File shrank underneath us; the client can't trust the body
+                self.close_connection = True
+                return
+            offset += sent
 
     def _send_error_response(self, code, message=""):
         """Send an error response matching IMDS behavior."""
-        self.send_response(code)
-        self.send_header("Content-Type", "text/plain")
-        self.send_header("Content-Length", str(len(message)))
-        self.end_headers()
-        if message:
-            self.wfile.write(message.encode())
+        self._send(code, cached(message.encode()))
 
     def _validate_token(self):
         """Validate the IMDSv2 session token on GET requests.
         Returns True if valid, sends 401 and returns False otherwise."""
         token = self.headers.get("X-aws-ec2-metadata-token")
         if token is None:
-            print("IMDS: GET rejected: missing X-aws-ec2-metadata-token header", file=sys.stderr, flush=True)
+            log("GET rejected: missing X-aws-ec2-metadata-token header")
             self._send_error_response(401, "Unauthorized")
             return False
         if token != TOKEN:
-            print(f"IMDS: GET rejected: invalid token (got {repr(token)}, expected {repr(TOKEN)})", file=sys.stderr, flush=True)
+            log(f"GET rejected: invalid token (got {repr(token)}, expected {repr(TOKEN)})")
             self._send_error_response(401, "Unauthorized")
             return False
         return True
@@ -120,14 +350,14 @@ class IMDSHandler(http.server.BaseHTTPRequestHandler):
         if self.path == "/latest/api/token":
             # Real IMDS rejects PUT with X-Forwarded-For header
             if self.headers.get("X-Forwarded-For") is not None:
-                print("IMDS: PUT rejected: X-Forwarded-For header present", file=sys.stderr, flush=True)
+                log("PUT rejected: X-Forwarded-For header present")
                 self._send_error_response(403, "Forbidden")
                 return
 
             # Real IMDS requires the TTL header
             ttl_header = self.headers.get("X-aws-ec2-metadata-token-ttl-seconds")
             if ttl_header is None:
-                print("IMDS: PUT rejected: missing X-aws-ec2-metadata-token-ttl-seconds header", file=sys.stderr, flush=True)
+                log("PUT rejected: missing X-aws-ec2-metadata-token-ttl-seconds header")
                 self._send_error_response(400, "Missing or Invalid Parameters - TTL")
                 return
 
@@ -137,21 +367,20 @@ class IMDSHandler(http.server.BaseHTTPRequestHandler):
                 if ttl < 1 or ttl > 21600:
                     raise ValueError("out of range")
             except ValueError:
-                print(f"IMDS: PUT rejected: invalid TTL value: {repr(ttl_header)}", file=sys.stderr, flush=True)
+                log(f"PUT rejected: invalid TTL value: {repr(ttl_header)}")
                 self._send_error_response(400, "Missing or Invalid Parameters - TTL")
                 return
 
-            token_bytes = TOKEN.encode()
-            print(f"IMDS: PUT /latest/api/token TTL={ttl} -> token ({len(token_bytes)} bytes)", file=sys.stderr, flush=True)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/plain")
-            self.send_header("Content-Length", str(len(token_bytes)))
-            self.send_header("X-aws-ec2-metadata-token-ttl-seconds", str(ttl))
-            self.end_headers()
-            self.wfile.write(token_bytes)
+            log(f"PUT /latest/api/token TTL={ttl} -> token ({len(TOKEN_BYTES[0])} bytes)")
+            if ttl == TOKEN_TTL and not self.close_connection:
+                self._send_raw(TOKEN_RESPONSE)
+            else:
+                self._send(
+                    200, TOKEN_BYTES,
+                    extra_headers=b"X-aws-ec2-metadata-token-ttl-seconds: %d\r\n" % ttl)
         elif self.path.startswith("/") and "/api/token" in self.path:
             # Version-specific token paths return 403
-            print(f"IMDS: PUT rejected: version-specific path {self.path}", file=sys.stderr, flush=True)
+            log(f"PUT rejected: version-specific path {self.path}")
             self._send_error_response(403, "Forbidden")
         else:
             self._send_error_response(404, "Not Found")
@@ -162,128 +391,27 @@ class IMDSHandler(http.server.BaseHTTPRequestHandler):
         if not self._validate_token():
             return
 
-        path = self.path.lstrip("/")
-
-        # User data (content-type is application/octet-stream per AWS docs)
-        if path == "latest/user-data":
-            if USER_DATA_BYTES is not None:
-                self._send_text(200, USER_DATA_BYTES, "application/octet-stream")
-            else:
-                user_data_file = SCENARIOS_DIR / SCENARIO / "user-data.yaml"
-                if user_data_file.is_file():
-                    content = user_data_file.read_bytes()
-                    self._send_text(200, content, "application/octet-stream")
-                else:
-                    self._send_error_response(404, "Not Found")
-            return
-
-        # Strip latest/meta-data/ prefix
-        if path.startswith("latest/meta-data/"):
-            meta_path = path[len("latest/meta-data/"):]
-        elif path.startswith("latest/dynamic/"):
-            meta_path = path[len("latest/"):]
-        else:
-            self._send_error_response(404, "Not Found")
-            return
-
-        # Network interface queries - respond to any MAC
-        if meta_path.startswith("network/interfaces/macs/"):
-            self._handle_network_metadata(meta_path)
+        # Static responses, prerendered for keep-alive connections
+        if not self.close_connection:
+            response = RAW_ROUTES.get(self.path)
+            if response is not None:
+                self._send_raw(response)
+                return
+        route = ROUTES.get(self.path)
+        if route is not None:
+            self._send(200, *route)
             return
 
-        # IAM credentials
-        if meta_path.startswith("iam/"):
-            self._handle_iam_metadata(meta_path)
+        if self.path == "/latest/user-data":
+            self._send_user_data()
             return
 
         # Spot termination notices
-        if meta_path.startswith("spot/"):
+        meta_path = self.path.removeprefix("/latest/meta-data/")
+        if meta_path != self.path and meta_path.startswith("spot/"):
             self._handle_spot_metadata(meta_path)
             return
 
-        # Dynamic instance identity document
-        if meta_path == "dynamic/instance-identity/document":
-            doc = {
-                "accountId": "123456789012",
-                "architecture": "x86_64",
-                "availabilityZone": "us-east-1a",
-                "billingProducts": None,
-                "devpayProductCodes": None,
-                "marketplaceProductCodes": None,
-                "imageId": "ami-test12345",
-                "instanceId": "i-test12345",
-                "instanceType": "t3.micro",
-                "kernelId": None,
-                "pendingTime": "2024-01-01T00:00:00Z",
-                "privateIp": "10.0.2.15",
-                "ramdiskId": None,
-                "region": "us-east-1",
-                "version": "2017-09-30",
-            }
-            content = json.dumps(doc).encode()
-            self._send_text(200, content, "application/json")
-            return
-
-        # Static metadata
-        if meta_path in METADATA:
-            content = METADATA[meta_path].encode()
-            self._send_text(200, content)
-        else:
-            self._send_error_response(404, "Not Found")
-
-    def _handle_network_metadata(self, meta_path):
-        """Handle network interface metadata queries."""
-        parts = meta_path.split("/")
-        # network/interfaces/macs/<mac>/...
-
-        # List MACs: network/interfaces/macs/
-        if meta_path == "network/interfaces/macs/" or meta_path == "network/interfaces/macs":
-            # Return all configured MACs
-            content = "\n".join(f"{mac}/" for mac in MACS).encode()
-            self._send_text(200, content)
-            return
-
-        if len(parts) >= 5:
-            mac = parts[3]
-            attr = "/".join(parts[4:])
-
-            # Find device number for this MAC
-            try:
-                device_num = MACS.index(mac)
-            except ValueError:
-                # Unknown MAC - return 404
-                self._send_error_response(404, "Not Found")
-                return
-
-            # Per-interface responses
-            responses = {
-                "device-number": str(device_num),
-                "local-ipv4s": f"10.0.2.{15 + device_num}",
-                "subnet-id": f"subnet-test{device_num}",
-                "vpc-id": "vpc-test123",
-            }
-
-            if attr in responses:
-                content = responses[attr].encode()
-                self._send_text(200, content)
-                return
-
-        self._send_error_response(404, "Not Found")
-
-    def _handle_iam_metadata(self, meta_path):
-        """Handle IAM credential metadata queries."""
-        # iam/security-credentials/ - list roles
-        if meta_path in ("iam/security-credentials/", "iam/security-credentials"):
-            content = IAM_ROLE.encode()
-            self._send_text(200, content)
-            return
-
-        # iam/security-credentials/<role-name> - get credentials
-        if meta_path == f"iam/security-credentials/{IAM_ROLE}":
-            content = json.dumps(IAM_CREDENTIALS).encode()
-            self._send_text(200, content, "application/json")
-            return
-
         self._send_error_response(404, "Not Found")
 
     def _handle_spot_metadata(self, meta_path):
@@ -301,8 +429,8 @@ class IMDSHandler(http.server.BaseHTTPRequestHandler):
                         "time": termination_time,
                     }
                     content = json.dumps(response).encode()
-                    print(f"IMDS: Returning spot termination notice: {response}", file=sys.stderr, flush=True)
-                    self._send_text(200, content, "application/json")
+                    log(f"Returning spot termination notice: {response}")
+                    self._send(200, cached(content), b"application/json")
                     return
 
             # No termination scheduled - return 404
@@ -312,32 +440,38 @@ class IMDSHandler(http.server.BaseHTTPRequestHandler):
         self._send_error_response(404, "Not Found")
 
 
+class IMDSServer(http.server.ThreadingHTTPServer):
+    """Threaded server so concurrent metadata fetches don't block each other."""
+    # The VM fires many requests at once during boot; the default
+    # backlog of 5 makes connections queue up behind accept().
+    request_queue_size = 128
+
+
 if __name__ == "__main__":
     PORT = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
-    SCENARIOS_DIR = Path(sys.argv[2]) if len(sys.argv) > 2 else Path("scenarios")
-    SCENARIO = sys.argv[3] if len(sys.argv) > 3 else "basic-boot"
-    NIC_COUNT = int(sys.argv[4]) if len(sys.argv) > 4 else 1
     SPOT_TERMINATION_DELAY = int(sys.argv[5]) if len(sys.argv) > 5 else 0
-    MACS = generate_macs(NIC_COUNT)
+    configure(
+        Path(sys.argv[2]) if len(sys.argv) > 2 else Path("scenarios"),
+        sys.argv[3] if len(sys.argv) > 3 else "basic-boot",
+        int(sys.argv[4]) if len(sys.argv) > 4 else 1,
+    )
 
-    setup_script = SCENARIOS_DIR / SCENARIO / "user-data-setup.sh"
-    if setup_script.is_file():
-        with tempfile.TemporaryDirectory() as tmpdir:
-            subprocess.run(["sh", str(setup_script), tmpdir], check=True)
-            ud_file = Path(tmpdir) / "user-data.yaml"
-            if ud_file.is_file():
-                USER_DATA_BYTES = ud_file.read_bytes()
-
-    print(f"Mock IMDS server starting on 0.0.0.0:{PORT}", file=sys.stderr, flush=True)
-    print(f"Scenarios dir: {SCENARIOS_DIR}", file=sys.stderr, flush=True)
-    print(f"Current scenario: {SCENARIO}", file=sys.stderr, flush=True)
-    print(f"NIC count: {NIC_COUNT}, MACs: {MACS}", file=sys.stderr, flush=True)
+    print(f"Mock IMDS server starting on 0.0.0.0:{PORT}", file=sys.stderr)
+    print(f"Scenarios dir: {SCENARIOS_DIR}", file=sys.stderr)
+    print(f"Current scenario: {SCENARIO}", file=sys.stderr)
+    print(f"NIC count: {NIC_COUNT}, MACs: {MACS}", file=sys.stderr)
     if SPOT_TERMINATION_DELAY > 0:
-        print(f"Spot termination: will trigger after {SPOT_TERMINATION_DELAY}s", file=sys.stderr, flush=True)
+        print(f"Spot termination: will trigger after {SPOT_TERMINATION_DELAY}s", file=sys.stderr)
     else:
-        print(f"Spot termination: disabled", file=sys.stderr, flush=True)
-
-    server = http.server.ThreadingHTTPServer(
-        ("0.0.0.0", PORT), IMDSHandler,
-    )
-    server.serve_forever()
+        print(f"Spot termination: disabled", file=sys.stderr)
+
+    # Exit through the finally below so queued log lines aren't lost
+    # when the integration runner kills the server.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    threading.Thread(target=_log_writer, daemon=True).start()
+
+    server = IMDSServer(("0.0.0.0", PORT), IMDSHandler)
+    try:
+        server.serve_forever()
+    finally:
+        flush_log()
@@ -2,26 +2,26 @@
 """Tests for the mock IMDS server."""
 
 import http.client
+import io
 import json
+import sys
 import threading
 import unittest
-from http.server import HTTPServer
 from pathlib import Path
 
 # Set module globals before importing
 import imds_server
 
+SCENARIOS_DIR = Path(__file__).parent.parent / "scenarios"
+
 # Override globals for testing
-imds_server.SCENARIOS_DIR = Path(__file__).parent.parent / "scenarios"
-imds_server.SCENARIO = "basic-boot"
-imds_server.NIC_COUNT = 2
-imds_server.MACS = imds_server.generate_macs(2)
+imds_server.configure(SCENARIOS_DIR, "basic-boot", 2)
 imds_server.SPOT_TERMINATION_DELAY = 0
 
 
 def start_server():
     """Start a test IMDS server on an ephemeral port."""
-    server = HTTPServer(("127.0.0.1", 0), imds_server.IMDSHandler)
+    server = imds_server.IMDSServer(("127.0.0.1", 0), imds_server.IMDSHandler)
     port = server.server_address[1]
     thread = threading.Thread(target=server.serve_forever, daemon=True)
     thread.start()
@@ -64,6 +64,14 @@ class TestIMDSToken(unittest.TestCase):
         self.assertEqual(
             r.getheader("X-aws-ec2-metadata-token-ttl-seconds"), "300")
 
+    def test_put_token_default_ttl_header(self):
+        r, _ = self.request(
+            "PUT", "/latest/api/token",
+            {"X-aws-ec2-metadata-token-ttl-seconds": "21600"})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(
+            r.getheader("X-aws-ec2-metadata-token-ttl-seconds"), "21600")
+
     def test_put_token_missing_ttl(self):
         r, _ = self.request("PUT", "/latest/api/token")
         self.assertEqual(r.status, 400)
@@ -249,6 +257,14 @@ class TestIMDSNetwork(unittest.TestCase):
         self.assertEqual(r.status, 200)
         self.assertEqual(body.decode(), "1")
 
+    def test_local_ipv4s_second_nic(self):
+        mac = imds_server.MACS[1]
+        r, body = self.get(
+            f"/latest/meta-data/network/interfaces/macs/"
+            f"{mac}/local-ipv4s")
+        self.assertEqual(r.status, 200)
+        self.assertEqual(body.decode(), "10.0.2.16")
+
     def test_unknown_mac_returns_404(self):
         r, _ = self.get(
             "/latest/meta-data/network/interfaces/macs/"
@@ -335,14 +351,47 @@ class TestIMDSUserData(unittest.TestCase):
             r.getheader("Content-Type"), "application/octet-stream")
         self.assertGreater(len(body), 0)
 
+    def test_user_data_matches_file(self):
+        r, body = self.get("/latest/user-data")
+        self.assertEqual(r.status, 200)
+        expected = (imds_server.SCENARIOS_DIR / "basic-boot" /
+                    "user-data.yaml").read_bytes()
+        self.assertEqual(body, expected)
+        self.assertEqual(
+            r.getheader("Content-Length"), str(len(expected)))
+
     def test_user_data_missing_scenario(self):
-        old = imds_server.SCENARIO
-        imds_server.SCENARIO = "nonexistent-scenario"
+        imds_server.configure(SCENARIOS_DIR, "nonexistent-scenario", 2)
         try:
             r, _ = self.get("/latest/user-data")
             self.assertEqual(r.status, 404)
         finally:
-            imds_server.SCENARIO = old
+            imds_server.configure(SCENARIOS_DIR, "basic-boot", 2)
+
+
+class TestIMDSConfigure(unittest.TestCase):
+    """Tests for rebuilding the derived tables."""
+
+    def tearDown(self):
+        imds_server.configure(SCENARIOS_DIR, "basic-boot", 2)
+
+    def test_configure_rebuilds_both_route_tables(self):
+        imds_server.configure(SCENARIOS_DIR, "basic-boot", 3)
+        self.assertEqual(len(imds_server.MACS), 3)
+        path = (f"/latest/meta-data/network/interfaces/macs/"
+                f"{imds_server.MACS[2]}/device-number")
+        self.assertIn(path, imds_server.ROUTES)
+        self.assertEqual(
+            imds_server.ROUTES.keys(), imds_server.RAW_ROUTES.keys())
+
+    def test_raw_response_matches_headers(self):
+        entry = imds_server.cached(b"body")
+        raw, size = imds_server.raw_response(entry, b"text/plain")
+        self.assertEqual(size, 4)
+        self.assertEqual(
+            raw,
+            imds_server.render_headers(200, b"text/plain", b"4", b"keep-alive")
+            + b"body")
 
 
 class TestIMDSInstanceIdentity(unittest.TestCase):
@@ -412,6 +461,18 @@ class TestIMDSSpot(unittest.TestCase):
         r, _ = self.get("/latest/meta-data/spot/instance-action")
         self.assertEqual(r.status, 404)
 
+    def test_spot_outside_meta_data_returns_404(self):
+        old = imds_server.SPOT_TERMINATION_DELAY
+        old_start = imds_server.SERVER_START_TIME
+        imds_server.SPOT_TERMINATION_DELAY = 1
+        imds_server.SERVER_START_TIME = imds_server.time.time() - 2
+        try:
+            r, _ = self.get("/latest/spot/instance-action")
+            self.assertEqual(r.status, 404)
+        finally:
+            imds_server.SPOT_TERMINATION_DELAY = old
+            imds_server.SERVER_START_TIME = old_start
+
     def test_termination_after_delay(self):
         old = imds_server.SPOT_TERMINATION_DELAY
         old_start = imds_server.SERVER_START_TIME
@@ -442,5 +503,94 @@ class TestIMDSSpot(unittest.TestCase):
             imds_server.SERVER_START_TIME = old_start
 
 
+class TestIMDSConcurrency(unittest.TestCase):
+    """Tests for concurrent requests from many clients."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server, cls.port = start_server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_parallel_requests(self):
+        results = []
+
+        def fetch():
+            c = http.client.HTTPConnection("127.0.0.1", self.port)
+            c.request("GET", "/latest/meta-data/instance-id",
+                      headers={"X-aws-ec2-metadata-token": imds_server.TOKEN})
+            r = c.getresponse()
+            results.append((r.status, r.read()))
+            c.close()
+
+        threads = [threading.Thread(target=fetch) for _ in range(32)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(results), 32)
+        for status, body in results:
+            self.assertEqual(status, 200)
+            self.assertEqual(body.decode(), "i-test12345")
+
+    def test_keep_alive(self):
+        c = http.client.HTTPConnection("127.0.0.1", self.port)
+        c.connect()
+        sock = c.sock
+        for path in ("/latest/meta-data/instance-id",
+                     "/latest/meta-data/local-hostname"):
+            c.request("GET", path,
+                      headers={"X-aws-ec2-metadata-token": imds_server.TOKEN})
+            r = c.getresponse()
+            r.read()
+            self.assertEqual(r.status, 200)
+            self.assertEqual(r.getheader("Connection"), "keep-alive")
+        self.assertIs(c.sock, sock)
+        c.close()
+
+    def test_connection_close(self):
+        c = http.client.HTTPConnection("127.0.0.1", self.port)
+        c.request("GET", "/latest/meta-data/instance-id",
+                  headers={"X-aws-ec2-metadata-token": imds_server.TOKEN,
+                           "Connection": "close"})
+        r = c.getresponse()
+        r.read()
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.getheader("Connection"), "close")
+        c.close()
+
+
+class RecordingBytesIO(io.BytesIO):
+    """BytesIO that records each write separately."""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def write(self, b):
+        self.writes.append(bytes(b))
+        return super().write(b)
+
+
+class TestIMDSLog(unittest.TestCase):
+    """Tests for the batched log writer."""
+
+    def test_flush_log_writes_batch(self):
+        imds_server.LOG_BUFFER.clear()
+        raw = RecordingBytesIO()
+        old_stderr = sys.stderr
+        sys.stderr = io.TextIOWrapper(raw)
+        try:
+            imds_server.log("first")
+            imds_server.log("second")
+            imds_server.flush_log()
+        finally:
+            sys.stderr = old_stderr
+        self.assertEqual(raw.writes, [b"IMDS: first\nIMDS: second\n"])
+        self.assertEqual(len(imds_server.LOG_BUFFER), 0)
+
+
 if __name__ == "__main__":
     unittest.main()